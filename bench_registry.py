@@ -0,0 +1,175 @@
+import json
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+import random
+from registry import FileRegistry
+
+
+def make_messages(num_peers, num_files, files_per_peer):
+    """生成模拟的register/share消息（经过JSON编解码，与真实请求一致）"""
+    rng = random.Random(42)
+    catalog = [f"Artist {i % 500} - Track {i}.mp3" for i in range(num_files)]
+    messages = []
+    for n in range(num_peers):
+        peer_id = str(uuid.UUID(int=rng.getrandbits(128)))[:8]
+        port = 6000 + n
+        files = rng.sample(catalog, files_per_peer)
+        messages.append(json.dumps({'command': 'register', 'peer_id': peer_id,
+                                    'ip': '127.0.0.1', 'peer_port': port}))
+        messages.append(json.dumps({'command': 'share', 'peer_id': peer_id, 'files': files}))
+    return messages
+
+
+def build_legacy(messages):
+    """原始实现: {peer_id: (ip, port)} 与 {filename: [peer_id, ...]}"""
+    peers = {}
+    shared_files = {}
+    for raw in messages:
+        message = json.loads(raw)
+        peer_id = message['peer_id']
+        if message['command'] == 'register':
+            peers[peer_id] = (message['ip'], message['peer_port'])
+        else:
+            for file in message['files']:
+                if file not in shared_files:
+                    shared_files[file] = []
+                if peer_id not in shared_files[file]:
+                    shared_files[file].append(peer_id)
+    return peers, shared_files
+
+
+def build_registry(messages):
+    registry = FileRegistry()
+    for raw in messages:
+        message = json.loads(raw)
+        if message['command'] == 'register':
+            registry.register_peer(message['peer_id'], message['ip'], message['peer_port'])
+        else:
+            registry.share(message['peer_id'], message['files'])
+    return registry
+
+
+def measure(builder, messages):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    structure = builder(messages)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return structure, after - before
+
+
+def main(num_peers=2000, num_files=200000, files_per_peer=100):
+    messages = make_messages(num_peers, num_files, files_per_peer)
+    # 只注册不共享时的内存即节点表的开销，其余部分计入文件索引
+    registers = [raw for raw in messages if json.loads(raw)['command'] == 'register']
+    legacy, legacy_bytes = measure(build_legacy, messages)
+    registry, registry_bytes = measure(build_registry, messages)
+    _, legacy_peer_bytes = measure(build_legacy, registers)
+    _, registry_peer_bytes = measure(build_registry, registers)
+    files = len(legacy[1])
+    assert files == len(registry)
+
+    print(f"节点数: {num_peers}, 文件数: {files}, 每节点共享: {files_per_peer}")
+    print(f"{'结构':<10}{'总字节':>14}{'节点表字节/节点':>14}{'索引字节/文件':>14}")
+    for name, total, peer_bytes in (('原始实现', legacy_bytes, legacy_peer_bytes),
+                                    ('FileRegistry', registry_bytes, registry_peer_bytes)):
+        print(f"{name:<10}{total:>14}{peer_bytes / num_peers:>14.1f}{(total - peer_bytes) / files:>14.1f}")
+    print(f"节省: {100 * (1 - registry_bytes / legacy_bytes):.1f}%")
+
+
+def register_scaling(sizes=(10000, 40000), probe=2000):
+    """测量已有N个节点时注册和注销的平均耗时，写时复制的开销不应随节点总数线性增长
+
+    耗时受机器负载影响，只输出供对比，不作为压测是否通过的依据。
+    """
+    costs = []
+    for size in sizes:
+        registry = FileRegistry()
+        for n in range(size):
+            registry.register_peer(f"peer-{n}", '127.0.0.1', n)
+        start = time.perf_counter()
+        for n in range(size, size + probe):
+            registry.register_peer(f"peer-{n}", '127.0.0.1', n)
+        cost = (time.perf_counter() - start) / probe
+        # 注销同样只应复制一个分块（文件索引为空，不计入扫描分片的开销）
+        start = time.perf_counter()
+        for n in range(size, size + probe):
+            registry.unregister_peer(f"peer-{n}")
+        costs.append((cost, (time.perf_counter() - start) / probe))
+        print(f"已有 {size} 个节点: 注册 {cost * 1e6:.1f} us/次, 注销 {costs[-1][1] * 1e6:.1f} us/次")
+    print(f"节点数增长 {sizes[-1] / sizes[0]:.0f} 倍，注册耗时变为 {costs[-1][0] / costs[0][0]:.2f} 倍，"
+          f"注销耗时变为 {costs[-1][1] / costs[0][1]:.2f} 倍")
+    return costs
+
+
+def stress(seconds=5, num_writers=4, num_readers=8, peers_per_writer=20):
+    """并发压测: 写线程不断注册/共享/注销节点，读线程同时搜索并校验快照一致性"""
+    registry = FileRegistry()
+    stop = threading.Event()
+    errors = []
+    counts = {'writes': 0, 'searches': 0}
+
+    def writer(w):
+        ports = range(7000 + w * peers_per_writer, 7000 + (w + 1) * peers_per_writer)
+        rng = random.Random(w)
+        while not stop.is_set():
+            port = rng.choice(ports)
+            peer_id = f"peer-{port}"
+            registry.register_peer(peer_id, '127.0.0.1', port)
+            registry.share(peer_id, [f"common-{k}.mp3" for k in range(20)])
+            registry.share(peer_id, [f"own-{port}-{k}.mp3" for k in range(10)])
+            if rng.random() < 0.7:
+                registry.unregister_peer(peer_id)
+            counts['writes'] += 1
+
+    def reader():
+        last_version = 0
+        while not stop.is_set():
+            try:
+                version = registry.version
+                if version < last_version:
+                    errors.append(f"版本回退: {last_version} -> {version}")
+                last_version = version
+                for filename, peers in registry.search('own-').items():
+                    port = int(filename.split('-')[1])
+                    if peers != [('127.0.0.1', port)]:
+                        errors.append(f"{filename} 的持有者不一致: {peers}")
+                for filename, peers in registry.search('COMMON').items():
+                    if not peers or len(set(peers)) != len(peers):
+                        errors.append(f"{filename} 的持有者不一致: {peers}")
+                counts['searches'] += 2
+            except Exception as e:
+                errors.append(repr(e))
+
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(num_writers)]
+    threads += [threading.Thread(target=reader) for _ in range(num_readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    for peer_id, _ in registry.peer_items():
+        registry.unregister_peer(peer_id)
+    if len(registry) or registry.peer_items():
+        errors.append("全部节点注销后索引未清空")
+
+    register_scaling()
+
+    print(f"写操作: {counts['writes']}, 搜索: {counts['searches']}, 最终版本: {registry.version}")
+    print(f"错误: {len(errors)}")
+    for error in errors[:10]:
+        print(f"  {error}")
+    return not errors
+
+
+if __name__ == "__main__":
+    # 用法: python bench_registry.py [节点数] [文件数] [每节点共享文件数]
+    #       python bench_registry.py --stress [秒数]
+    if sys.argv[1:2] == ['--stress']:
+        sys.exit(0 if stress(*[int(arg) for arg in sys.argv[2:3]]) else 1)
+    main(*[int(arg) for arg in sys.argv[1:4]])
@@ -2,6 +2,8 @@ import socket
 import threading
 import json
 import os
+from registry import FileRegistry
+from protocol import recv_json
 
 class CentralServer:
     def __init__(self, host='0.0.0.0', port=5000):
@@ -10,74 +12,68 @@ class CentralServer:
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.bind((self.host, self.port))
         self.server_socket.listen(5)
-        self.peers = {}  # 存储节点信息: {peer_id: (ip, port)}
-        self.shared_files = {}  # 存储共享文件: {filename: [peer_id1, peer_id2...]}
+        self.registry = FileRegistry()  # 节点信息与共享文件的紧凑索引
         print(f"中心服务器启动在 {self.host}:{self.port}")
 
     def handle_client(self, client_socket, client_address):
         try:
             while True:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
+                message = recv_json(client_socket)
+                if message is None:
                     break
                 
-                message = json.loads(data)
                 response = self.process_message(message, client_address)
-                client_socket.send(json.dumps(response).encode('utf-8'))
+                client_socket.sendall(json.dumps(response).encode('utf-8'))
         except Exception as e:
             print(f"处理客户端 {client_address} 时出错: {e}")
         finally:
             # 客户端断开连接时，移除其注册的信息
-            peer_id_to_remove = None
-            for peer_id, addr in self.peers.items():
-                if addr == client_address:
-                    peer_id_to_remove = peer_id
-                    break
+            peer_id_to_remove = self.registry.find_peer_by_address(client_address)
             
             if peer_id_to_remove:
-                del self.peers[peer_id_to_remove]
-                # 从共享文件列表中移除该节点的文件
-                for filename in list(self.shared_files.keys()):
-                    if peer_id_to_remove in self.shared_files[filename]:
-                        self.shared_files[filename].remove(peer_id_to_remove)
-                        if not self.shared_files[filename]:
-                            del self.shared_files[filename]
+                # 注销节点并从共享文件列表中移除该节点的文件
+                self.registry.unregister_peer(peer_id_to_remove)
                 print(f"节点 {peer_id_to_remove} 已断开连接")
             
             client_socket.close()
 
     def process_message(self, message, client_address):
+        if not isinstance(message, dict):
+            return {'status': 'error', 'message': '消息格式错误'}
         command = message.get('command')
         
         if command == 'register':
             peer_id = message.get('peer_id')
             peer_port = message.get('peer_port')
-            self.peers[peer_id] = (client_address[0], peer_port)
+            self.registry.register_peer(peer_id, client_address[0], peer_port)
             print(f"节点 {peer_id} 已注册: {client_address[0]}:{peer_port}")
             return {'status': 'success', 'message': '注册成功'}
         
         elif command == 'share':
             peer_id = message.get('peer_id')
             files = message.get('files', [])
-            for file in files:
-                if file not in self.shared_files:
-                    self.shared_files[file] = []
-                if peer_id not in self.shared_files[file]:
-                    self.shared_files[file].append(peer_id)
-            print(f"节点 {peer_id} 共享了 {len(files)} 个文件")
+            added = self.registry.share(peer_id, files)
+            if added is None:
+                return {'status': 'error', 'message': '节点未注册'}
+            print(f"节点 {peer_id} 共享了 {len(files)} 个文件，新增 {added} 个")
             return {'status': 'success', 'message': f'共享了 {len(files)} 个文件'}
         
         elif command == 'search':
-            keyword = message.get('keyword', '').lower()
-            results = {}
-            for filename, peers in self.shared_files.items():
-                if keyword in filename.lower():
-                    # 将peer_id转换为实际的IP和端口
-                    results[filename] = [self.peers[peer_id] for peer_id in peers]
+            keyword = message.get('keyword', '')
+            results = self.registry.search(keyword)
             return {'status': 'success', 'results': results}
         
+        elif command == 'search_batch':
+            # 一次请求完成多个关键词搜索和多个文件的下载源解析
+            try:
+                results, sources = self.registry.search_batch(message.get('keywords', []),
+                                                              message.get('filenames', []))
+            except ValueError as e:
+                return {'status': 'error', 'message': str(e)}
+            return {'status': 'success', 'results': results, 'sources': sources}
+        
         elif command == 'get_peers':
-            return {'status': 'success', 'peers': list(self.peers.items())}
+            return {'status': 'success', 'peers': self.registry.peer_items()}
         
         else:
             return {'status': 'error', 'message': '未知命令'}
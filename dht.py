@@ -0,0 +1,344 @@
+import socket
+import threading
+import json
+import hashlib
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ID_BITS = 160            # 节点ID和键的位数（SHA-1）
+K = 8                    # 每个k桶的容量，也是每个键的副本数
+ALPHA = 3                # 迭代查找时的并行请求数
+RPC_TIMEOUT = 1.0        # 单次RPC的超时时间（秒）
+VALUE_TTL = 3600         # 存储的文件位置的有效期（秒）
+REPUBLISH_INTERVAL = 1800  # 重新发布本节点文件的间隔（秒）
+MAX_VALUES = 50          # 单个响应中最多返回的文件位置数（避免超出UDP数据报大小）
+
+
+def key_id(text):
+    """将文件名等字符串映射为160位的键"""
+    return int(hashlib.sha1(text.encode('utf-8')).hexdigest(), 16)
+
+
+class Contact:
+    """DHT中的一个节点"""
+    __slots__ = ('node_id', 'ip', 'port')
+
+    def __init__(self, node_id, ip, port):
+        self.node_id = node_id
+        self.ip = ip
+        self.port = port
+
+    @property
+    def address(self):
+        return (self.ip, self.port)
+
+    def to_wire(self):
+        return [format(self.node_id, 'x'), self.ip, self.port]
+
+
+class RoutingTable:
+    """Kademlia路由表: 按与本节点ID的异或距离划分的k桶"""
+
+    def __init__(self, node_id, k=K):
+        self.node_id = node_id
+        self.k = k
+        self.buckets = [[] for _ in range(ID_BITS)]
+        self.lock = threading.Lock()
+
+    def _bucket(self, node_id):
+        return self.buckets[(self.node_id ^ node_id).bit_length() - 1]
+
+    def add(self, contact):
+        """记录一个活跃节点，返回是否为新加入的节点；桶已满时保留旧节点（长期在线的节点更可能继续在线）"""
+        if contact.node_id == self.node_id:
+            return False
+        with self.lock:
+            bucket = self._bucket(contact.node_id)
+            for i, existing in enumerate(bucket):
+                if existing.node_id == contact.node_id:
+                    # 移到桶尾，表示最近活跃
+                    del bucket[i]
+                    bucket.append(contact)
+                    return False
+            if len(bucket) < self.k:
+                bucket.append(contact)
+                return True
+            return False
+
+    def remove(self, node_id):
+        with self.lock:
+            bucket = self._bucket(node_id)
+            bucket[:] = [c for c in bucket if c.node_id != node_id]
+
+    def closest(self, target, count):
+        with self.lock:
+            contacts = [c for bucket in self.buckets for c in bucket]
+        contacts.sort(key=lambda c: c.node_id ^ target)
+        return contacts[:count]
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(bucket) for bucket in self.buckets)
+
+
+class DHTNode:
+    """基于UDP的Kademlia风格DHT节点
+
+    每个文件名的键存储在与其异或距离最近的k个节点上，值为可以下载该文件的
+    节点地址 (ip, peer_port)。查找时并行地向最近的alpha个节点迭代查询。
+    中心服务器过载或重启时，节点仍然可以通过DHT按文件名查找下载源。
+    """
+
+    def __init__(self, host='0.0.0.0', port=6000, node_id=None, k=K, alpha=ALPHA):
+        self.node_id = node_id if node_id is not None else random.getrandbits(ID_BITS)
+        self.k = k
+        self.alpha = alpha
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.host, self.port = self.sock.getsockname()
+        self.routing = RoutingTable(self.node_id, k)
+        self.storage = {}       # 存储的文件位置: {key: {(ip, port): 过期时间}}，ip为None表示本节点
+        self.storage_lock = threading.Lock()
+        self.published = {}     # 本节点发布的文件: {filename: peer_port}
+        self.pending = {}       # 等待响应的RPC: {rpc_id: [Event, response]}
+        self.pending_lock = threading.Lock()
+        self.running = True
+        threading.Thread(target=self._serve, daemon=True).start()
+        threading.Thread(target=self._republish_loop, daemon=True).start()
+
+    # 网络层
+    def _send(self, address, message):
+        message['id'] = format(self.node_id, 'x')
+        self.sock.sendto(json.dumps(message).encode('utf-8'), address)
+
+    def _serve(self):
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(65535)
+                message = json.loads(data.decode('utf-8'))
+                contact = Contact(int(message['id'], 16), address[0], address[1])
+                if self.routing.add(contact):
+                    # 新节点可能比已有副本更接近某些键，在后台把这些键复制给它
+                    threading.Thread(target=self._replicate_to, args=(contact,), daemon=True).start()
+                if message['type'] == 'response':
+                    with self.pending_lock:
+                        waiter = self.pending.get(message['rpc'])
+                    if waiter:
+                        waiter[1] = message
+                        waiter[0].set()
+                else:
+                    response = self._handle(message, address)
+                    response.update({'type': 'response', 'rpc': message['rpc']})
+                    self._send(address, response)
+            except OSError:
+                if not self.running:
+                    break
+            except Exception as e:
+                print(f"处理DHT消息时出错: {e}")
+
+    def _rpc(self, address, message, contact=None):
+        """发送请求并等待响应，超时返回None并将该节点移出路由表"""
+        rpc_id = uuid.uuid4().hex
+        waiter = [threading.Event(), None]
+        with self.pending_lock:
+            self.pending[rpc_id] = waiter
+        try:
+            self._send(address, dict(message, rpc=rpc_id))
+            waiter[0].wait(RPC_TIMEOUT)
+        except OSError:
+            pass
+        finally:
+            with self.pending_lock:
+                del self.pending[rpc_id]
+        if waiter[1] is None and contact is not None:
+            self.routing.remove(contact.node_id)
+        return waiter[1]
+
+    # 请求处理
+    def _handle(self, message, address):
+        command = message['type']
+        if command == 'ping':
+            return {}
+        if command == 'store':
+            # 文件位置默认使用发送方的IP，与中心服务器登记节点的方式一致；
+            # 复制其他节点发布的位置时由ip字段指明
+            self._store(int(message['key'], 16), (message.get('ip', address[0]), message['port']))
+            return {}
+        if command in ('find_node', 'find_value'):
+            target = int(message['target'], 16)
+            if command == 'find_value':
+                values = self._local_values(target)
+                if values:
+                    return {'values': values[:MAX_VALUES]}
+            return {'nodes': [c.to_wire() for c in self.routing.closest(target, self.k)]}
+        return {'error': '未知命令'}
+
+    def _store(self, key, location):
+        with self.storage_lock:
+            self.storage.setdefault(key, {})[location] = time.time() + VALUE_TTL
+
+    def _local_values(self, key):
+        now = time.time()
+        with self.storage_lock:
+            locations = self.storage.get(key)
+            if not locations:
+                return []
+            for location, expires in list(locations.items()):
+                if expires < now:
+                    del locations[location]
+            if not locations:
+                del self.storage[key]
+            return [list(location) for location in locations]
+
+    def _replicate_to(self, contact):
+        """把新节点应当保存的键（它属于离该键最近的k个节点）复制给它"""
+        with self.storage_lock:
+            keys = list(self.storage)
+        for key in keys:
+            if all(c.node_id != contact.node_id for c in self.routing.closest(key, self.k)):
+                continue
+            for ip, port in self._local_values(key):
+                message = {'type': 'store', 'key': format(key, 'x'), 'port': port}
+                if ip is not None:
+                    message['ip'] = ip
+                if self._rpc(contact.address, message, contact) is None:
+                    return
+
+    # 迭代查找
+    def _lookup(self, target, find_value=False):
+        """并行迭代地查找离target最近的k个节点，find_value时找到文件位置即停止"""
+        message = {'type': 'find_value' if find_value else 'find_node', 'target': format(target, 'x')}
+        shortlist = {c.node_id: c for c in self.routing.closest(target, self.k)}
+        queried = set()
+        values = set()
+        with ThreadPoolExecutor(max_workers=self.alpha) as pool:
+            while True:
+                candidates = sorted(shortlist.values(), key=lambda c: c.node_id ^ target)[:self.k]
+                to_query = [c for c in candidates if c.node_id not in queried][:self.alpha]
+                if not to_query:
+                    break
+                queried.update(c.node_id for c in to_query)
+                responses = pool.map(lambda c: self._rpc(c.address, message, c), to_query)
+                for contact, response in zip(to_query, responses):
+                    if response is None:
+                        shortlist.pop(contact.node_id, None)
+                        continue
+                    # 没有IP的位置属于响应的节点本身
+                    values.update((ip or contact.ip, port) for ip, port in response.get('values', []))
+                    for node_hex, ip, port in response.get('nodes', []):
+                        node_id = int(node_hex, 16)
+                        if node_id != self.node_id and node_id not in shortlist:
+                            shortlist[node_id] = Contact(node_id, ip, port)
+                if values:
+                    break
+        closest = sorted(shortlist.values(), key=lambda c: c.node_id ^ target)[:self.k]
+        return closest, values
+
+    # 公共接口
+    def bootstrap(self, addresses):
+        """通过已知节点加入网络，返回可达的引导节点数"""
+        reachable = 0
+        for address in addresses:
+            if self._rpc(tuple(address), {'type': 'ping'}) is not None:
+                reachable += 1
+        if reachable:
+            # 查找自己的ID，填充路由表并让附近的节点认识自己
+            self._lookup(self.node_id)
+            # 加入前发布的文件（例如引导失败时）只保存在本地，现在发布到网络中
+            self._republish()
+        return reachable
+
+    def publish(self, filename, peer_port):
+        """将本节点可提供的文件存储到离其键最近的k个节点上，返回成功存储的副本数
+
+        本节点也在最近的k个节点之内时（包括路由表为空时）会在本地保存一份。
+        """
+        self.published[filename] = peer_port
+        key = key_id(filename)
+        closest, _ = self._lookup(key)
+        stored = 0
+        if len(closest) < self.k or self.node_id ^ key < closest[-1].node_id ^ key:
+            self._store(key, (None, peer_port))
+            closest = closest[:self.k - 1]
+            stored = 1
+        message = {'type': 'store', 'key': format(key, 'x'), 'port': peer_port}
+        with ThreadPoolExecutor(max_workers=self.alpha) as pool:
+            responses = pool.map(lambda c: self._rpc(c.address, message, c), closest)
+            return stored + sum(1 for response in responses if response is not None)
+
+    def lookup(self, filename):
+        """按文件名查找可下载该文件的节点地址 [(ip, port), ...]"""
+        key = key_id(filename)
+        values = self._local_values(key)
+        if values:
+            return [(ip or '127.0.0.1', port) for ip, port in values]
+        _, values = self._lookup(key, find_value=True)
+        return sorted(values)
+
+    def _republish(self):
+        for filename, peer_port in list(self.published.items()):
+            try:
+                self.publish(filename, peer_port)
+            except Exception as e:
+                print(f"重新发布 {filename} 时出错: {e}")
+
+    def _republish_loop(self):
+        while self.running:
+            time.sleep(REPUBLISH_INTERVAL)
+            self._republish()
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+
+
+def simulate(num_nodes=40, num_files=100, failures=10):
+    """在回环地址上启动多个DHT节点，验证发布、查找、晚加入的节点以及部分节点下线后的查找"""
+    nodes = [DHTNode(host='127.0.0.1', port=0) for _ in range(num_nodes)]
+    seed = (nodes[0].host, nodes[0].port)
+    expected = {}
+    # 第一个节点在其他节点加入前发布，其他节点加入时应从它那里获得副本
+    nodes[0].publish("Early.mp3", 6999)
+    expected["Early.mp3"] = ('127.0.0.1', 6999)
+    for node in nodes[1:-1]:
+        node.bootstrap([seed])
+    # 最后一个节点先在引导失败的情况下发布，网络形成后再加入
+    late = nodes[-1]
+    late.publish("Late.mp3", 6998)
+    expected["Late.mp3"] = ('127.0.0.1', 6998)
+    late.bootstrap([seed])
+    print(f"已启动 {num_nodes} 个节点，平均路由表大小: "
+          f"{sum(len(n.routing) for n in nodes) / num_nodes:.1f}")
+
+    rng = random.Random(0)
+    for i in range(num_files):
+        filename = f"Track {i}.mp3"
+        publisher = rng.choice(nodes)
+        publisher.publish(filename, 7000 + i)
+        expected[filename] = ('127.0.0.1', 7000 + i)
+
+    def check(alive):
+        time.sleep(0.5)  # 等待后台复制完成
+        start = time.time()
+        found = sum(1 for filename, location in expected.items()
+                    if location in rng.choice(alive).lookup(filename))
+        return found, (time.time() - start) / len(expected)
+
+    found, latency = check(nodes)
+    print(f"全部在线: 找到 {found}/{len(expected)}，平均查找耗时 {latency * 1000:.1f} ms")
+    for node in rng.sample(nodes, failures):
+        node.stop()
+        nodes.remove(node)
+    found_after, latency = check(nodes)
+    print(f"{failures} 个节点下线后: 找到 {found_after}/{len(expected)}，平均查找耗时 {latency * 1000:.1f} ms")
+    for node in nodes:
+        node.stop()
+    return found == found_after == len(expected)
+
+
+if __name__ == "__main__":
+    # 用法: python dht.py [节点数] [文件数] [下线节点数]
+    sys.exit(0 if simulate(*[int(arg) for arg in sys.argv[1:4]]) else 1)
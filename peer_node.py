@@ -4,10 +4,15 @@ import json
 import os
 import uuid
 import time
+from dht import DHTNode
+from profiling import TransferTimer
 from tkinter import Tk, Listbox, Entry, Button, Label, filedialog, messagebox, Scrollbar, Frame
 
+TRACKER_TIMEOUT = 3.0  # 连接中心服务器及等待其响应的超时时间（秒），超时后改用DHT查找
+
 class MusicSharingPeer:
-    def __init__(self, central_host='localhost', central_port=5000, peer_port=5001):
+    def __init__(self, central_host='localhost', central_port=5000, peer_port=5001,
+                 dht_port=None, dht_bootstrap=()):
         self.central_host = central_host
         self.central_port = central_port
         self.peer_port = peer_port
@@ -28,6 +33,14 @@ class MusicSharingPeer:
         self.peer_server_socket.listen(5)
         threading.Thread(target=self.start_peer_server, daemon=True).start()
         
+        # 可选: 加入DHT覆盖网络，中心服务器过载或重启时仍可按文件名查找
+        self.dht = None
+        self.dht_published = set()  # 已发布到DHT的文件，DHTNode会定期重新发布它们
+        if dht_port is not None:
+            self.dht = DHTNode(port=dht_port)
+            reachable = self.dht.bootstrap(dht_bootstrap)
+            print(f"DHT节点启动在端口 {self.dht.port}，可达引导节点: {reachable}")
+        
         # 连接到中心服务器并注册
         self.register_with_central_server()
         
@@ -41,6 +54,7 @@ class MusicSharingPeer:
         """向中心服务器注册节点"""
         try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.settimeout(TRACKER_TIMEOUT)
                 s.connect((self.central_host, self.central_port))
                 message = {
                     'command': 'register',
@@ -64,7 +78,15 @@ class MusicSharingPeer:
                           if os.path.isfile(os.path.join(self.shared_dir, f)) 
                           and f.lower().endswith(('.mp3', '.wav', '.flac', '.m4a'))]
             
+            if self.dht is not None:
+                # 只发布新增的文件，在后台进行，不依赖中心服务器是否可用
+                new_files = [f for f in music_files if f not in self.dht_published]
+                self.dht_published.update(new_files)
+                if new_files:
+                    threading.Thread(target=self.publish_to_dht, args=(new_files,), daemon=True).start()
+            
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.settimeout(TRACKER_TIMEOUT)
                 s.connect((self.central_host, self.central_port))
                 message = {
                     'command': 'share',
@@ -81,9 +103,18 @@ class MusicSharingPeer:
             print(f"共享文件时出错: {e}")
 
     def search_files(self, keyword):
-        """搜索网络中的音乐文件"""
+        """搜索网络中的音乐文件
+
+        查询在后台线程中进行，中心服务器超时和DHT查找期间界面不会卡住，
+        结果通过root.after交回GUI线程显示。
+        """
+        threading.Thread(target=self.run_search, args=(keyword,), daemon=True).start()
+
+    def run_search(self, keyword):
+        timer = TransferTimer('search_files', keyword=keyword)
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            with timer.stage('tracker_lookup'), socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.settimeout(TRACKER_TIMEOUT)
                 s.connect((self.central_host, self.central_port))
                 message = {
                     'command': 'search',
@@ -91,58 +122,88 @@ class MusicSharingPeer:
                 }
                 s.send(json.dumps(message).encode('utf-8'))
                 response = json.loads(s.recv(4096).decode('utf-8'))
-                
-                if response['status'] == 'success':
-                    self.search_results = response['results']
-                    self.update_search_results()
-                else:
-                    messagebox.showerror("错误", response['message'])
+            timer.finish(response['status'])
+            
+            if response['status'] == 'success':
+                self.root.after(0, self.show_search_results, response['results'])
+            else:
+                self.root.after(0, messagebox.showerror, "错误", response['message'])
         except Exception as e:
             print(f"搜索文件时出错: {e}")
-            messagebox.showerror("错误", f"搜索失败: {str(e)}")
+            if self.dht is None:
+                timer.finish('error', error=str(e))
+                self.root.after(0, messagebox.showerror, "错误", f"搜索失败: {str(e)}")
+                return
+            # 中心服务器不可用时，通过DHT按完整文件名查找
+            with timer.stage('dht_lookup'):
+                peers = self.dht.lookup(keyword)
+            timer.finish('dht', error=str(e))
+            self.root.after(0, self.show_search_results, {keyword: peers} if peers else {})
+
+    def publish_to_dht(self, music_files):
+        """将本地共享文件发布到DHT"""
+        for filename in music_files:
+            try:
+                self.dht.publish(filename, self.peer_port)
+            except Exception as e:
+                print(f"发布 {filename} 到DHT时出错: {e}")
 
     def download_file(self, filename, peer_address):
         """从指定节点下载文件"""
+        # 计时各阶段耗时，transfer_id随请求发给对端以便关联双方的记录
+        timer = TransferTimer('download_file', filename=filename, peer=list(peer_address))
+        received_size = 0
         try:
             ip, port = peer_address
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((ip, port))
+                with timer.stage('connect'):
+                    s.connect((ip, port))
                 message = {
                     'command': 'download',
-                    'filename': filename
+                    'filename': filename,
+                    'transfer_id': timer.transfer_id
                 }
-                s.send(json.dumps(message).encode('utf-8'))
                 
-                # 接收文件大小
-                file_size_data = s.recv(1024).decode('utf-8')
-                if not file_size_data:
-                    raise Exception("未收到文件大小信息")
-                
-                file_size = int(file_size_data)
-                s.send(b"ready")  # 确认已收到文件大小
+                with timer.stage('size_handshake'):
+                    s.send(json.dumps(message).encode('utf-8'))
+                    
+                    # 接收文件大小
+                    file_size_data = s.recv(1024).decode('utf-8')
+                    if not file_size_data:
+                        raise Exception("未收到文件大小信息")
+                    
+                    file_size = int(file_size_data)
+                    s.send(b"ready")  # 确认已收到文件大小
                 
                 # 接收文件内容
                 download_path = os.path.join(self.download_dir, filename)
-                received_size = 0
                 
                 with open(download_path, 'wb') as f:
                     while received_size < file_size:
+                        start = time.perf_counter()
                         data = s.recv(4096)
+                        timer.add('socket_recv', time.perf_counter() - start)
                         if not data:
                             break
+                        start = time.perf_counter()
                         f.write(data)
+                        timer.add('disk_write', time.perf_counter() - start)
                         received_size += len(data)
                         # 更新进度（简化版）
-                        self.update_download_status(f"下载中: {received_size}/{file_size} bytes")
+                        with timer.stage('ui_update'):
+                            self.update_download_status(f"下载中: {received_size}/{file_size} bytes")
                 
                 if received_size == file_size:
+                    timer.finish(bytes=received_size)
                     messagebox.showinfo("成功", f"文件 {filename} 下载完成！")
                     self.update_download_status("下载完成")
                     # 下载完成后，将文件加入共享
                     self.share_local_files()
                 else:
+                    timer.finish('incomplete', bytes=received_size)
                     messagebox.showerror("错误", f"文件下载不完整，只收到 {received_size}/{file_size} bytes")
         except Exception as e:
+            timer.finish('error', bytes=received_size, error=str(e))
             print(f"下载文件时出错: {e}")
             messagebox.showerror("错误", f"下载失败: {str(e)}")
 
@@ -155,6 +216,7 @@ class MusicSharingPeer:
 
     def handle_peer_request(self, client_socket, client_address):
         """处理其他节点的请求（主要是文件下载请求）"""
+        timer = None
         try:
             data = client_socket.recv(1024).decode('utf-8')
             if not data:
@@ -164,26 +226,38 @@ class MusicSharingPeer:
             if message['command'] == 'download':
                 filename = message['filename']
                 file_path = os.path.join(self.shared_dir, filename)
+                # 沿用下载方带来的transfer_id，旧版本节点没有时生成新的
+                timer = TransferTimer('handle_peer_request', message.get('transfer_id'),
+                                      filename=filename, peer=list(client_address))
                 
                 if os.path.exists(file_path) and os.path.isfile(file_path):
-                    # 发送文件大小
-                    file_size = os.path.getsize(file_path)
-                    client_socket.send(str(file_size).encode('utf-8'))
-                    
-                    # 等待客户端确认
-                    client_socket.recv(1024)
+                    with timer.stage('size_handshake'):
+                        # 发送文件大小
+                        file_size = os.path.getsize(file_path)
+                        client_socket.send(str(file_size).encode('utf-8'))
+                        
+                        # 等待客户端确认
+                        client_socket.recv(1024)
                     
                     # 发送文件内容
                     with open(file_path, 'rb') as f:
                         while True:
+                            start = time.perf_counter()
                             data = f.read(4096)
+                            timer.add('disk_read', time.perf_counter() - start)
                             if not data:
                                 break
+                            start = time.perf_counter()
                             client_socket.send(data)
+                            timer.add('socket_send', time.perf_counter() - start)
+                    timer.finish(bytes=file_size)
                     print(f"已向 {client_address} 发送文件: {filename}")
                 else:
                     client_socket.send(b"0")  # 表示文件不存在
+                    timer.finish('not_found')
         except Exception as e:
+            if timer is not None:
+                timer.finish('error', error=str(e))
             print(f"处理节点请求时出错: {e}")
         finally:
             client_socket.close()
@@ -291,6 +365,10 @@ class MusicSharingPeer:
             peer_address = self.search_results[filename][0]
             self.download_file(filename, peer_address)
 
+    def show_search_results(self, results):
+        self.search_results = results
+        self.update_search_results()
+
     def update_search_results(self):
         """更新搜索结果列表"""
         self.results_listbox.delete(0, "end")
@@ -324,6 +402,8 @@ class MusicSharingPeer:
         """关闭窗口时的清理工作"""
         self.running = False
         self.peer_server_socket.close()
+        if self.dht is not None:
+            self.dht.stop()
         self.root.destroy()
 
     def run(self):
@@ -332,13 +412,15 @@ class MusicSharingPeer:
 
 if __name__ == "__main__":
     # 可以指定不同的端口号来运行多个节点
-    import sys
-    peer_port = 5001
-    if len(sys.argv) > 1:
-        try:
-            peer_port = int(sys.argv[1])
-        except ValueError:
-            pass
+    # 用法: python peer_node.py [端口号] [--dht DHT端口] [--bootstrap 主机:端口 ...]
+    import argparse
+    parser = argparse.ArgumentParser(description="P2P音乐共享节点")
+    parser.add_argument('peer_port', nargs='?', type=int, default=5001, help="节点文件服务端口")
+    parser.add_argument('--dht', type=int, dest='dht_port', help="加入DHT覆盖网络并监听该UDP端口")
+    parser.add_argument('--bootstrap', action='append', default=[], metavar='HOST:PORT',
+                        help="DHT引导节点地址，可重复指定")
+    args = parser.parse_args()
+    bootstrap = [(host, int(port)) for host, port in (b.rsplit(':', 1) for b in args.bootstrap)]
     
-    peer = MusicSharingPeer(peer_port=peer_port)
+    peer = MusicSharingPeer(peer_port=args.peer_port, dht_port=args.dht_port, dht_bootstrap=bootstrap)
     peer.run()
@@ -0,0 +1,168 @@
+import sys
+import json
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+recent_transfers = deque(maxlen=200)  # 最近完成的传输计时记录
+MIN_SAMPLE_INTERVAL = 0.001  # 采样间隔下限（秒），过小会让采样线程占满CPU
+MAX_SAMPLE_INTERVAL = 1.0    # 采样间隔上限（秒）
+
+
+def new_transfer_id():
+    return uuid.uuid4().hex[:12]
+
+
+class TransferTimer:
+    """记录一次传输各阶段的耗时
+
+    同一次传输的所有阶段共享一个transfer_id，下载请求会把它带给对端节点，
+    双方的计时记录可以据此关联起来。循环中交替出现的阶段（如接收数据和
+    写入磁盘）会累加到同一个阶段名下。
+    """
+
+    def __init__(self, kind, transfer_id=None, **fields):
+        self.kind = kind
+        self.transfer_id = transfer_id or new_transfer_id()
+        self.fields = fields
+        self.stages = {}  # {阶段名: 累计秒数}，保持阶段出现的顺序
+        self.started = time.perf_counter()
+        self.finished = False
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def finish(self, status='ok', **fields):
+        """结束计时，输出一行结构化记录并返回该记录（重复调用时只记录一次）"""
+        if self.finished:
+            return None
+        self.finished = True
+        self.fields.update(fields)
+        record = {
+            'kind': self.kind,
+            'transfer_id': self.transfer_id,
+            'status': status,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+        }
+        record.update(self.fields)
+        recent_transfers.append(record)
+        print(f"[timing] {json.dumps(record, ensure_ascii=False)}")
+        return record
+
+
+class TimedBody:
+    """包装WSGI响应体，把发送响应体的耗时计入计时器
+
+    Flask的路由返回send_file等响应时文件还没有发送，真正的传输发生在服务器
+    迭代响应体期间。服务器发送完毕（或客户端中途断开）后会调用close，
+    此时记录发送阶段并结束计时，total_ms因此覆盖整个传输过程。
+    """
+
+    def __init__(self, body, timer, stage='send_file', **fields):
+        self.body = body
+        self.timer = timer
+        self.stage_name = stage
+        self.fields = fields
+        self.started = None
+        self.completed = False
+
+    def __iter__(self):
+        self.started = time.perf_counter()
+        for chunk in self.body:
+            yield chunk
+        self.completed = True
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            if self.started is not None:
+                self.timer.add(self.stage_name, time.perf_counter() - self.started)
+            self.timer.finish('ok' if self.completed else 'aborted', **self.fields)
+
+
+class SamplingProfiler:
+    """按固定间隔采样所有线程调用栈的采样分析器
+
+    可在进程运行时随时启动和停止，停止后输出折叠栈格式
+    （"帧1;帧2;帧3 次数"，每行一个栈），可直接交给flamegraph.pl等工具生成火焰图。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.samples = 0
+        self.interval = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, interval=0.005):
+        """开始采样，已在运行时返回False
+
+        间隔会被限制在MIN_SAMPLE_INTERVAL和MAX_SAMPLE_INTERVAL之间，非有限值抛出ValueError。
+        """
+        if not math.isfinite(interval):
+            raise ValueError('采样间隔必须是有限的数字')
+        interval = min(max(interval, MIN_SAMPLE_INTERVAL), MAX_SAMPLE_INTERVAL)
+        with self.lock:
+            if self.thread is not None:
+                return False
+            self.counts = {}
+            self.samples = 0
+            self.interval = interval
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        """停止采样并返回折叠栈文本，未在运行时返回None"""
+        with self.lock:
+            thread = self.thread
+            if thread is None:
+                return None
+            self.stop_event.set()
+        thread.join()
+        with self.lock:
+            self.thread = None
+            return self.collapsed()
+
+    def collapsed(self):
+        lines = sorted(f"{stack} {count}" for stack, count in self.counts.items())
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self.stop_event.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
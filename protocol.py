@@ -0,0 +1,52 @@
+import json
+import re
+import select
+
+MAX_MESSAGE_SIZE = 1024 * 1024  # 单条节点消息的最大字节数
+
+# JSON在输入末尾被截断时，出错位置之后可能剩下的不完整记号
+_PARTIAL_TOKEN = re.compile(
+    r'[tfn]|tr|tru|fa|fal|fals|nu|nul|-|[.eE][+-]?'
+    r'|u[0-9a-fA-F]{0,4}(\\(u[0-9a-fA-F]{0,4})?)?'
+)
+
+
+def _truncated(error):
+    """判断JSON解析错误是否只是因为消息还没收完"""
+    rest = error.doc[error.pos:]
+    return (error.pos >= len(error.doc)
+            or error.msg.startswith('Unterminated string')
+            or _PARTIAL_TOKEN.fullmatch(rest) is not None)
+
+
+def recv_json(sock, max_size=MAX_MESSAGE_SIZE):
+    """接收一条完整的JSON消息，连接关闭时返回None
+
+    消息没有长度前缀，批量请求可能超过单次recv的大小。只有当JSON在输入末尾
+    中断（或UTF-8字符被截断）时才继续读取，其他格式错误立即抛出ValueError。
+    对端仍在发送时先读完已到达的数据再解析，避免每收到一块就重新解析整个缓冲区。
+    """
+    data = bytearray()
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            if not data:
+                return None
+            # 对端已关闭写入，剩余数据必须是一条完整的消息
+            return json.loads(data.decode('utf-8'))
+        data += chunk
+        if len(data) > max_size:
+            raise ValueError(f"消息超过 {max_size} 字节")
+        if select.select([sock], [], [], 0)[0]:
+            continue
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError as e:
+            if e.reason == 'unexpected end of data' and e.end == len(data):
+                continue
+            raise
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            if not _truncated(e):
+                raise
@@ -0,0 +1,341 @@
+import sys
+import threading
+from array import array
+
+_SHARD_SIZE = 32  # 索引每个分片的平均容量上限，超过时分片数翻倍
+_GROUP_BITS = 6  # 索引的分片按 2**6 个一组存放
+_GROUP_MASK = (1 << _GROUP_BITS) - 1
+_PEER_CHUNK_BITS = 8  # 节点表按句柄分块，每块 2**8 个节点
+_PEER_CHUNK_MASK = (1 << _PEER_CHUNK_BITS) - 1
+MAX_BATCH = 32  # 单次批量查询最多的关键词数和文件名数（各自计算），每个不同的关键词都要遍历一次索引
+
+
+class _ShardedMap:
+    """按哈希分片的只读字典，发布后不再修改
+
+    分片数随条目数翻倍增长，平均每片不超过_SHARD_SIZE项；分片再按
+    2**_GROUP_BITS个一组存放。修改一项只需复制顶层的组列表、一个组和一个分片，
+    复制量不随索引大小线性增长。修改通过_MapWriter完成。
+    """
+    __slots__ = ('groups', 'mask', 'size')
+
+    def __init__(self, groups, mask, size):
+        self.groups = groups  # 分片组列表，第i个分片为 groups[i >> _GROUP_BITS][i & _GROUP_MASK]
+        self.mask = mask      # 分片数减一（分片数为2的幂，按哈希低位选择分片）
+        self.size = size
+
+    def get(self, key):
+        i = hash(key) & self.mask
+        return self.groups[i >> _GROUP_BITS][i & _GROUP_MASK].get(key)
+
+    def shards(self):
+        return (shard for group in self.groups for shard in group)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return (key for shard in self.shards() for key in shard)
+
+    def items(self):
+        return (item for shard in self.shards() for item in shard.items())
+
+
+def _grouped(shards):
+    return [shards[i:i + _GROUP_MASK + 1] for i in range(0, len(shards), _GROUP_MASK + 1)]
+
+
+class _MapWriter:
+    """在_ShardedMap的副本上批量修改，只复制被修改的组和分片，build()返回新版本"""
+
+    def __init__(self, base):
+        self.base = base
+        self.groups = list(base.groups)
+        self.mask = base.mask
+        self.size = base.size
+        self.copied_groups = set()
+        self.copied = set()  # 已复制的分片
+
+    def get(self, key):
+        i = hash(key) & self.mask
+        return self.groups[i >> _GROUP_BITS][i & _GROUP_MASK].get(key)
+
+    def shard(self, i):
+        return self.groups[i >> _GROUP_BITS][i & _GROUP_MASK]
+
+    def _writable(self, key):
+        i = hash(key) & self.mask
+        g = i >> _GROUP_BITS
+        if i not in self.copied:
+            if g not in self.copied_groups:
+                self.groups[g] = list(self.groups[g])
+                self.copied_groups.add(g)
+            group = self.groups[g]
+            group[i & _GROUP_MASK] = dict(group[i & _GROUP_MASK])
+            self.copied.add(i)
+        return self.groups[g][i & _GROUP_MASK]
+
+    def set(self, key, value):
+        shard = self._writable(key)
+        if key not in shard:
+            self.size += 1
+        shard[key] = value
+
+    def delete(self, key):
+        del self._writable(key)[key]
+        self.size -= 1
+
+    def build(self):
+        if not self.copied:
+            return self.base
+        count = self.mask + 1
+        if self.size <= count * _SHARD_SIZE:
+            return _ShardedMap(self.groups, self.mask, self.size)
+        # 分片数翻倍并重新分布所有条目，均摊到每次插入为O(1)
+        while self.size > count * _SHARD_SIZE:
+            count *= 2
+        shards = [{} for _ in range(count)]
+        mask = count - 1
+        for group in self.groups:
+            for shard in group:
+                for key, value in shard.items():
+                    shards[hash(key) & mask][key] = value
+        return _ShardedMap(_grouped(shards), mask, self.size)
+
+
+_EMPTY_MAP = _ShardedMap([[{}]], 0, 0)
+
+
+class _Snapshot:
+    """某一版本的只读索引视图，发布后不再修改"""
+    __slots__ = ('version', 'peer_index', 'peers', 'files')
+
+    def __init__(self, version, peer_index, peers, files):
+        self.version = version
+        self.peer_index = peer_index  # _ShardedMap {peer_id: 节点句柄}
+        self.peers = peers            # 节点表分块列表，块内按句柄低位存放节点地址(ip, port)（已释放为None）
+        self.files = files            # _ShardedMap {filename: 节点句柄 或 array('I')}
+
+    def peer(self, handle):
+        return self.peers[handle >> _PEER_CHUNK_BITS][handle & _PEER_CHUNK_MASK]
+
+    def handle_of(self, peer_id):
+        return self.peer_index.get(peer_id)
+
+    def peer_items(self):
+        return ((peer_id, self.peer(handle)) for peer_id, handle in self.peer_index.items())
+
+
+def _addresses(snap, holders):
+    if type(holders) is int:
+        return [snap.peer(holders)]
+    return [snap.peer(h) for h in holders]
+
+
+def _with_peer(chunks, handle, address):
+    """返回替换了一个节点地址的新分块列表，只复制该节点所在的块"""
+    chunks = list(chunks)
+    c = handle >> _PEER_CHUNK_BITS
+    if c == len(chunks):
+        chunks.append([None] * (_PEER_CHUNK_MASK + 1))
+    else:
+        chunks[c] = list(chunks[c])
+    chunks[c][handle & _PEER_CHUNK_MASK] = address
+    return chunks
+
+
+class FileRegistry:
+    """节点与共享文件的紧凑索引
+
+    节点ID映射为整数句柄（句柄对象在所有文件间共享），文件名本身作为唯一的键。
+    每个文件的持有者:
+    - 只有一个持有者时直接保存该节点句柄（最常见的情况，不额外分配对象）
+    - 多个持有者时保存为 array('I')，每个持有者只占4字节
+    释放的节点句柄会被复用，避免节点表无限增长。
+
+    并发模型为写时复制: 写操作在锁内只复制受影响的节点表分块、节点ID分片和文件分片，修改后
+    发布一个新版本的快照；读操作只读取一次当前快照，无需加锁，并发的搜索
+    总是看到一致的视图。每个节点共享的文件另外以文件名哈希的低32位记录在只由写操作
+    使用的数组中（保存文件名本身会让重复共享的文件名字符串无法释放），注销节点时
+    只访问这些哈希所在的分片。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()  # 只串行化写操作
+        self._free_peers = []
+        self._handles = []  # 按句柄值存放句柄对象本身，多个持有者退化为一个时复用同一个对象
+        self._peer_files = {}  # {节点句柄: array('I', 文件名哈希)}，只在写锁内访问
+        self._snapshot = _Snapshot(0, _EMPTY_MAP, [], _EMPTY_MAP)
+
+    def _publish(self, peer_index, peers, files):
+        self._snapshot = _Snapshot(self._snapshot.version + 1, peer_index, peers, files)
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def register_peer(self, peer_id, ip, port):
+        """注册节点，已存在时更新其地址"""
+        # 地址元组只创建一次，搜索时直接复用；同一IP的节点共享同一个字符串
+        address = (sys.intern(ip), port)
+        with self._lock:
+            snap = self._snapshot
+            peer_index = snap.peer_index
+            handle = snap.handle_of(peer_id)
+            if handle is None:
+                if self._free_peers:
+                    handle = self._free_peers.pop()
+                else:
+                    handle = len(self._handles)
+                    self._handles.append(handle)
+                peer_index = _MapWriter(peer_index)
+                peer_index.set(peer_id, handle)
+                peer_index = peer_index.build()
+            self._publish(peer_index, _with_peer(snap.peers, handle, address), snap.files)
+
+    def unregister_peer(self, peer_id):
+        """注销节点并移除其共享的文件，返回节点是否存在"""
+        with self._lock:
+            snap = self._snapshot
+            handle = snap.handle_of(peer_id)
+            if handle is None:
+                return False
+            peer_index = _MapWriter(snap.peer_index)
+            peer_index.delete(peer_id)
+            peer_index = peer_index.build()
+            peers = _with_peer(snap.peers, handle, None)
+            files = _MapWriter(snap.files)
+            for i in {h & files.mask for h in self._peer_files.pop(handle, ())}:
+                for filename, holders in list(files.shard(i).items()):
+                    if type(holders) is int:
+                        if holders == handle:
+                            files.delete(filename)
+                        continue
+                    if handle not in holders:
+                        continue
+                    holders = array('I', [h for h in holders if h != handle])
+                    if len(holders) == 1:
+                        # 只剩一个持有者时退化为共享的句柄对象
+                        holders = self._handles[holders[0]]
+                    files.set(filename, holders)
+            self._publish(peer_index, peers, files.build())
+            self._free_peers.append(handle)
+            return True
+
+    def share(self, peer_id, files):
+        """记录节点共享的文件，返回新增的文件数；节点未注册时不做修改并返回None"""
+        with self._lock:
+            snap = self._snapshot
+            handle = snap.handle_of(peer_id)
+            if handle is None:
+                return None
+            index = _MapWriter(snap.files)
+            shared = self._peer_files.setdefault(handle, array('I'))
+            added = 0
+            for filename in files:
+                holders = index.get(filename)
+                if holders is None:
+                    holders = handle
+                elif type(holders) is int:
+                    if holders == handle:
+                        continue
+                    holders = array('I', (holders, handle))
+                elif handle not in holders:
+                    # 已发布的数组不能原地修改，拼接出新的数组
+                    holders = holders + array('I', (handle,))
+                else:
+                    continue
+                index.set(filename, holders)
+                shared.append(hash(filename) & 0xFFFFFFFF)
+                added += 1
+            if added:
+                self._publish(snap.peer_index, snap.peers, index.build())
+            return added
+
+    def has_peer(self, peer_id):
+        return self._snapshot.handle_of(peer_id) is not None
+
+    def find_peer_by_address(self, address):
+        """根据(ip, port)查找节点ID，找不到时返回None"""
+        for peer_id, peer_address in self._snapshot.peer_items():
+            if peer_address == address:
+                return peer_id
+        return None
+
+    def holders(self, filename):
+        """返回持有该文件的节点地址列表 [(ip, port), ...]"""
+        snap = self._snapshot
+        holders = snap.files.get(filename)
+        if holders is None:
+            return []
+        return _addresses(snap, holders)
+
+    def search(self, keyword):
+        """按关键词搜索文件名，返回 {filename: [(ip, port), ...]}"""
+        snap = self._snapshot
+        keyword = keyword.lower()
+        return {filename: _addresses(snap, holders)
+                for shard in snap.files.shards()
+                for filename, holders in shard.items()
+                if keyword in filename.lower()}
+
+    def search_batch(self, keywords, filenames=()):
+        """一次遍历索引完成多个关键词搜索和多个文件名解析
+
+        返回 (results, sources):
+        - results: 与keywords一一对应的 [{filename: [(ip, port), ...]}, ...]
+        - sources: {filename: [(ip, port), ...]}，找不到的文件为空列表
+        每个文件的节点按其能提供本批次中多少个文件降序排列，
+        这样整张歌单可以尽量从少数几个节点下载。
+        keywords或filenames不是字符串列表，或超过MAX_BATCH项时抛出ValueError。
+        """
+        if not isinstance(keywords, (list, tuple)) or not isinstance(filenames, (list, tuple)) \
+                or not all(isinstance(item, str) for item in (*keywords, *filenames)):
+            raise ValueError('keywords和filenames必须是字符串列表')
+        if len(keywords) > MAX_BATCH or len(filenames) > MAX_BATCH:
+            raise ValueError(f'keywords和filenames各自最多{MAX_BATCH}项')
+        snap = self._snapshot
+        keywords = [keyword.lower() for keyword in keywords]
+        # 重复的关键词只匹配一次，结果对象在它们之间共享
+        unique = {keyword: {} for keyword in keywords}
+        if unique:
+            pending = list(unique.items())
+            for shard in snap.files.shards():
+                for filename, holders in shard.items():
+                    lower = filename.lower()
+                    for keyword, found in pending:
+                        if keyword in lower:
+                            found[filename] = holders
+        resolved = {filename: snap.files.get(filename) for filename in filenames}
+
+        # 统计每个节点能提供本批次中的多少个不同文件
+        hits = {}
+        for found in (*unique.values(), resolved):
+            hits.update((f, h) for f, h in found.items() if h is not None)
+        load = {}
+        for holders in hits.values():
+            for h in ((holders,) if type(holders) is int else holders):
+                load[h] = load.get(h, 0) + 1
+
+        def ranked(holders):
+            if holders is None:
+                return []
+            if type(holders) is int:
+                return [snap.peer(holders)]
+            return [snap.peer(h) for h in sorted(holders, key=lambda h: -load[h])]
+
+        ranked_matches = {keyword: {f: ranked(h) for f, h in found.items()}
+                          for keyword, found in unique.items()}
+        results = [ranked_matches[keyword] for keyword in keywords]
+        sources = {f: ranked(h) for f, h in resolved.items()}
+        return results, sources
+
+    def filenames(self):
+        return list(self._snapshot.files)
+
+    def peer_items(self):
+        """返回 [(peer_id, (ip, port)), ...]"""
+        return list(self._snapshot.peer_items())
+
+    def __len__(self):
+        return len(self._snapshot.files)
@@ -122,6 +122,7 @@ class WebMusicPeer {
             const formData = new FormData();
             formData.append('file', file);
             formData.append('peer_id', this.peerId);
+            formData.append('peer_port', this.peerPort);
             
             const response = await fetch('/api/upload', {
                 method: 'POST',
@@ -217,6 +218,29 @@ class WebMusicPeer {
         }
     }
     
+    async searchBatch(keywords, filenames = []) {
+        // 一次请求完成多个关键词搜索和多个文件的下载源解析
+        try {
+            const response = await fetch('/api/search/batch', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ keywords, filenames })
+            });
+            const data = await response.json();
+            
+            if (data.status === 'success') {
+                return { success: true, results: data.results, sources: data.sources };
+            } else {
+                return { success: false, message: data.message };
+            }
+        } catch (error) {
+            console.error('批量搜索文件时发生错误:', error);
+            return { success: false, message: error.message };
+        }
+    }
+    
     async getAvailableFiles() {
         try {
             const response = await fetch('/api/files');
@@ -314,6 +338,12 @@ async function handleFileSearch(keyword) {
     return await peer.searchFiles(keyword);
 }
 
+// 批量搜索处理（例如导入歌单）
+async function handleBatchSearch(keywords, filenames) {
+    const peer = initWebMusicPeer();
+    return await peer.searchBatch(keywords, filenames);
+}
+
 // 刷新文件列表
 async function refreshFileList() {
     const peer = initWebMusicPeer();
@@ -338,5 +368,6 @@ window.initWebMusicPeer = initWebMusicPeer;
 window.handleFileUpload = handleFileUpload;
 window.handleFileDownload = handleFileDownload;
 window.handleFileSearch = handleFileSearch;
+window.handleBatchSearch = handleBatchSearch;
 window.refreshFileList = refreshFileList;
 window.refreshPeerList = refreshPeerList;
\ No newline at end of file
@@ -4,8 +4,11 @@ import json
 import os
 import uuid
 import time
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, g, Response
 from flask_socketio import SocketIO, emit, join_room
+from registry import FileRegistry
+from protocol import recv_json
+from profiling import TransferTimer, TimedBody, SamplingProfiler, recent_transfers
 
 class CentralServer:
     def __init__(self, host='0.0.0.0', port=5000):
@@ -14,78 +17,72 @@ class CentralServer:
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.bind((self.host, self.port))
         self.server_socket.listen(5)
-        self.peers = {}  # 存储节点信息: {peer_id: (ip, port)}
-        self.shared_files = {}  # 存储共享文件: {filename: [peer_id1, peer_id2...]}
+        self.registry = FileRegistry()  # 节点信息与共享文件的紧凑索引
         print(f"中心服务器启动在 {self.host}:{self.port}")
 
     def handle_client(self, client_socket, client_address):
         try:
             while True:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
+                message = recv_json(client_socket)
+                if message is None:
                     break
                 
-                message = json.loads(data)
                 response = self.process_message(message, client_address)
-                client_socket.send(json.dumps(response).encode('utf-8'))
+                client_socket.sendall(json.dumps(response).encode('utf-8'))
         except Exception as e:
             print(f"处理客户端 {client_address} 时出错: {e}")
         finally:
             # 客户端断开连接时，移除其注册的信息
-            peer_id_to_remove = None
-            for peer_id, addr in self.peers.items():
-                if addr == client_address:
-                    peer_id_to_remove = peer_id
-                    break
+            peer_id_to_remove = self.registry.find_peer_by_address(client_address)
             
             if peer_id_to_remove:
-                del self.peers[peer_id_to_remove]
-                # 从共享文件列表中移除该节点的文件
-                for filename in list(self.shared_files.keys()):
-                    if peer_id_to_remove in self.shared_files[filename]:
-                        self.shared_files[filename].remove(peer_id_to_remove)
-                        if not self.shared_files[filename]:
-                            del self.shared_files[filename]
+                # 注销节点并从共享文件列表中移除该节点的文件
+                self.registry.unregister_peer(peer_id_to_remove)
                 print(f"节点 {peer_id_to_remove} 已断开连接")
                 # 通过WebSocket广播文件列表更新
-                socketio.emit('file_list_updated', {'files': list(self.shared_files.keys())}, namespace='/music')
+                socketio.emit('file_list_updated', {'files': self.registry.filenames()}, namespace='/music')
             
             client_socket.close()
 
     def process_message(self, message, client_address):
+        if not isinstance(message, dict):
+            return {'status': 'error', 'message': '消息格式错误'}
         command = message.get('command')
         
         if command == 'register':
             peer_id = message.get('peer_id')
             peer_port = message.get('peer_port')
-            self.peers[peer_id] = (client_address[0], peer_port)
+            self.registry.register_peer(peer_id, client_address[0], peer_port)
             print(f"节点 {peer_id} 已注册: {client_address[0]}:{peer_port}")
             return {'status': 'success', 'message': '注册成功'}
         
         elif command == 'share':
             peer_id = message.get('peer_id')
             files = message.get('files', [])
-            for file in files:
-                if file not in self.shared_files:
-                    self.shared_files[file] = []
-                if peer_id not in self.shared_files[file]:
-                    self.shared_files[file].append(peer_id)
-            print(f"节点 {peer_id} 共享了 {len(files)} 个文件")
+            added = self.registry.share(peer_id, files)
+            if added is None:
+                return {'status': 'error', 'message': '节点未注册'}
+            print(f"节点 {peer_id} 共享了 {len(files)} 个文件，新增 {added} 个")
             # 通过WebSocket广播文件列表更新
-            socketio.emit('file_list_updated', {'files': list(self.shared_files.keys())}, namespace='/music')
+            socketio.emit('file_list_updated', {'files': self.registry.filenames()}, namespace='/music')
             return {'status': 'success', 'message': f'共享了 {len(files)} 个文件'}
         
         elif command == 'search':
-            keyword = message.get('keyword', '').lower()
-            results = {}  # 存储搜索结果
-            for filename, peers in self.shared_files.items():
-                if keyword in filename.lower():
-                    # 将peer_id转换为实际的IP和端口
-                    results[filename] = [self.peers[peer_id] for peer_id in peers]
+            keyword = message.get('keyword', '')
+            results = self.registry.search(keyword)  # 存储搜索结果
             return {'status': 'success', 'results': results}
         
+        elif command == 'search_batch':
+            # 一次请求完成多个关键词搜索和多个文件的下载源解析
+            try:
+                results, sources = self.registry.search_batch(message.get('keywords', []),
+                                                              message.get('filenames', []))
+            except ValueError as e:
+                return {'status': 'error', 'message': str(e)}
+            return {'status': 'success', 'results': results, 'sources': sources}
+        
         elif command == 'get_peers':
-            return {'status': 'success', 'peers': list(self.peers.items())}
+            return {'status': 'success', 'peers': self.registry.peer_items()}
         
         else:
             return {'status': 'error', 'message': '未知命令'}
@@ -108,6 +105,9 @@ central_server = CentralServer()
 # 存储Web客户端的连接信息
 web_clients = {}
 
+# 按需启动的采样分析器，通过 /admin/profiler 路由控制
+profiler = SamplingProfiler()
+
 # 确保目录存在
 def ensure_directories():
     if not os.path.exists('shared_music'):
@@ -119,6 +119,32 @@ def ensure_directories():
     if not os.path.exists('static'):
         os.makedirs('static')
 
+# 传输计时: 路由中调用start_transfer_timer，响应发送完毕后结束计时
+def start_transfer_timer(kind, **fields):
+    # 客户端可以通过X-Transfer-Id请求头传入关联ID
+    g.transfer_timer = TransferTimer(kind, request.headers.get('X-Transfer-Id'), **fields)
+    return g.transfer_timer
+
+@app.after_request
+def finish_transfer_timer(response):
+    timer = g.pop('transfer_timer', None)
+    if timer is not None:
+        response.headers['X-Transfer-Id'] = timer.transfer_id
+        has_body = request.method != 'HEAD' and response.status_code not in (204, 304)
+        if has_body and (response.direct_passthrough or response.is_streamed):
+            # 文件等流式响应在服务器发送完响应体后才结束计时
+            response.response = TimedBody(response.response, timer, http_status=response.status_code)
+        else:
+            failed = response.is_json and (response.get_json(silent=True) or {}).get('status') == 'error'
+            timer.finish('error' if failed else 'ok', http_status=response.status_code)
+    return response
+
+def require_local_admin():
+    # 管理路由只允许从本机访问
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'status': 'error', 'message': '仅允许本机访问'}), 403
+    return None
+
 # Web路由
 @app.route('/')
 def index():
@@ -126,20 +152,30 @@ def index():
 
 @app.route('/api/search')
 def api_search():
-    keyword = request.args.get('keyword', '').lower()
-    results = {}
-    for filename, peers in central_server.shared_files.items():
-        if keyword in filename.lower():
-            results[filename] = [central_server.peers[peer_id] for peer_id in peers]
+    keyword = request.args.get('keyword', '')
+    results = central_server.registry.search(keyword)
     return jsonify({'status': 'success', 'results': results})
 
+@app.route('/api/search/batch', methods=['POST'])
+def api_search_batch():
+    # 一次请求完成多个关键词搜索和多个文件的下载源解析，例如导入整张歌单
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': '请求体必须是JSON对象'})
+    try:
+        results, sources = central_server.registry.search_batch(data.get('keywords', []),
+                                                                data.get('filenames', []))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+    return jsonify({'status': 'success', 'results': results, 'sources': sources})
+
 @app.route('/api/files')
 def api_files():
-    return jsonify({'status': 'success', 'files': list(central_server.shared_files.keys())})
+    return jsonify({'status': 'success', 'files': central_server.registry.filenames()})
 
 @app.route('/api/peers')
 def api_peers():
-    return jsonify({'status': 'success', 'peers': list(central_server.peers.items())})
+    return jsonify({'status': 'success', 'peers': central_server.registry.peer_items()})
 
 @app.route('/api/register', methods=['POST'])
 def api_register():
@@ -149,12 +185,12 @@ def api_register():
     
     # 对于Web客户端，我们使用Web服务器的IP和一个随机端口
     client_ip = request.remote_addr
-    central_server.peers[peer_id] = (client_ip, peer_port)
+    central_server.registry.register_peer(peer_id, client_ip, peer_port)
     
     print(f"Web客户端 {peer_id} 已注册: {client_ip}:{peer_port}")
     
     # 广播节点列表更新
-    socketio.emit('peer_list_updated', {'peers': list(central_server.peers.items())}, namespace='/music')
+    socketio.emit('peer_list_updated', {'peers': central_server.registry.peer_items()}, namespace='/music')
     
     return jsonify({'status': 'success', 'message': '注册成功'})
 
@@ -163,20 +199,13 @@ def api_unregister():
     data = request.json
     peer_id = data.get('peer_id')
     
-    if peer_id in central_server.peers:
-        del central_server.peers[peer_id]
-        # 从共享文件列表中移除该节点的文件
-        for filename in list(central_server.shared_files.keys()):
-            if peer_id in central_server.shared_files[filename]:
-                central_server.shared_files[filename].remove(peer_id)
-                if not central_server.shared_files[filename]:
-                    del central_server.shared_files[filename]
-        
+    # 注销节点并从共享文件列表中移除该节点的文件
+    if central_server.registry.unregister_peer(peer_id):
         print(f"Web客户端 {peer_id} 已注销")
         
         # 广播更新
-        socketio.emit('peer_list_updated', {'peers': list(central_server.peers.items())}, namespace='/music')
-        socketio.emit('file_list_updated', {'files': list(central_server.shared_files.keys())}, namespace='/music')
+        socketio.emit('peer_list_updated', {'peers': central_server.registry.peer_items()}, namespace='/music')
+        socketio.emit('file_list_updated', {'files': central_server.registry.filenames()}, namespace='/music')
         
         return jsonify({'status': 'success', 'message': '注销成功'})
     else:
@@ -187,7 +216,7 @@ def api_heartbeat():
     data = request.json
     peer_id = data.get('peer_id')
     
-    if peer_id in central_server.peers:
+    if central_server.registry.has_peer(peer_id):
         # 简单地更新最后活跃时间（在实际应用中可能需要存储这个信息）
         print(f"收到节点 {peer_id} 的心跳包")
         return jsonify({'status': 'success', 'message': '心跳包已接收'})
@@ -207,21 +236,35 @@ def api_upload():
     if not peer_id:
         return jsonify({'status': 'error', 'message': '节点ID不能为空'})
     
+    # Web客户端的注册请求可能晚于上传到达（或服务器重启后尚未重新注册），此时用上传请求中的信息注册节点
+    if not central_server.registry.has_peer(peer_id):
+        try:
+            peer_port = int(request.form.get('peer_port', ''))
+        except ValueError:
+            return jsonify({'status': 'error', 'message': '节点未注册'})
+        central_server.registry.register_peer(peer_id, request.remote_addr, peer_port)
+        print(f"Web客户端 {peer_id} 通过上传请求注册: {request.remote_addr}:{peer_port}")
+        socketio.emit('peer_list_updated', {'peers': central_server.registry.peer_items()}, namespace='/music')
+    
+    timer = start_transfer_timer('api_upload', filename=file.filename, peer_id=peer_id)
     try:
         # 保存文件到共享目录
         file_path = os.path.join('shared_music', file.filename)
-        file.save(file_path)
+        with timer.stage('save'):
+            file.save(file_path)
         
         # 更新共享文件列表
-        if file.filename not in central_server.shared_files:
-            central_server.shared_files[file.filename] = []
-        if peer_id not in central_server.shared_files[file.filename]:
-            central_server.shared_files[file.filename].append(peer_id)
+        with timer.stage('index'):
+            added = central_server.registry.share(peer_id, [file.filename])
+        if added is None:
+            # 节点在保存文件期间被注销
+            return jsonify({'status': 'error', 'message': '节点未注册'})
         
         print(f"Web客户端 {peer_id} 共享了文件: {file.filename}")
         
         # 广播文件列表更新
-        socketio.emit('file_list_updated', {'files': list(central_server.shared_files.keys())}, namespace='/music')
+        with timer.stage('broadcast'):
+            socketio.emit('file_list_updated', {'files': central_server.registry.filenames()}, namespace='/music')
         
         return jsonify({'status': 'success', 'message': '文件上传成功'})
     except Exception as e:
@@ -237,10 +280,13 @@ def api_download():
     if not filename:
         return jsonify({'status': 'error', 'message': '文件名不能为空'})
     
+    timer = start_transfer_timer('api_download', filename=filename)
     try:
         # 首先检查本地是否有该文件
         local_file_path = os.path.join('shared_music', filename)
-        if os.path.exists(local_file_path):
+        with timer.stage('local_check'):
+            found_locally = os.path.exists(local_file_path)
+        if found_locally:
             # 如果本地有，直接提供下载
             print(f"从本地提供文件下载: {filename}")
             return send_from_directory('shared_music', filename, as_attachment=True)
@@ -252,7 +298,8 @@ def api_download():
             
             # 模拟从其他节点下载文件
             # 在实际应用中，这里应该建立socket连接并下载文件
-            time.sleep(1)  # 模拟下载延迟
+            with timer.stage('peer_fetch'):
+                time.sleep(1)  # 模拟下载延迟
             
             # 检查是否已经下载到downloads目录
             download_path = os.path.join('downloads', filename)
@@ -263,24 +310,62 @@ def api_download():
                 return jsonify({'status': 'error', 'message': '文件不存在'})
         
         # 查找所有可用的节点
-        if filename in central_server.shared_files:
-            peers = central_server.shared_files[filename]
-            if peers:
-                # 选择第一个可用的节点
-                peer_id = peers[0]
-                if peer_id in central_server.peers:
-                    peer_ip, peer_port = central_server.peers[peer_id]
-                    # 重定向到该节点下载
-                    print(f"重定向到节点 {peer_ip}:{peer_port} 下载文件: {filename}")
-                    # 在实际应用中，这里应该建立socket连接并下载文件
-                    time.sleep(1)  # 模拟下载延迟
-                    return jsonify({'status': 'success', 'message': f'开始从节点 {peer_ip}:{peer_port} 下载'})
+        with timer.stage('tracker_lookup'):
+            peers = central_server.registry.holders(filename)
+        if peers:
+            # 选择第一个可用的节点
+            peer_ip, peer_port = peers[0]
+            # 重定向到该节点下载
+            print(f"重定向到节点 {peer_ip}:{peer_port} 下载文件: {filename}")
+            # 在实际应用中，这里应该建立socket连接并下载文件
+            with timer.stage('peer_fetch'):
+                time.sleep(1)  # 模拟下载延迟
+            return jsonify({'status': 'success', 'message': f'开始从节点 {peer_ip}:{peer_port} 下载'})
         
         return jsonify({'status': 'error', 'message': '没有找到可用的文件源'})
     except Exception as e:
         print(f"文件下载失败: {e}")
         return jsonify({'status': 'error', 'message': str(e)})
 
+# 管理路由: 传输计时记录与采样分析器
+@app.route('/admin/transfers')
+def admin_transfers():
+    denied = require_local_admin()
+    if denied:
+        return denied
+    return jsonify({'status': 'success', 'transfers': list(recent_transfers)})
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+def admin_profiler():
+    denied = require_local_admin()
+    if denied:
+        return denied
+    
+    # GET只查询状态，启动和停止会改变服务器状态，只接受POST
+    action = request.args.get('action')
+    if request.method == 'GET' or action is None:
+        return jsonify({'status': 'success', 'running': profiler.running, 'samples': profiler.samples})
+    
+    if action == 'start':
+        try:
+            started = profiler.start(float(request.args.get('interval', 0.005)))
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'interval必须是有限的数字'})
+        if not started:
+            return jsonify({'status': 'error', 'message': '采样分析器已在运行'})
+        print(f"采样分析器已启动，间隔 {profiler.interval} 秒")
+        return jsonify({'status': 'success', 'message': '采样分析器已启动'})
+    
+    if action == 'stop':
+        collapsed = profiler.stop()
+        if collapsed is None:
+            return jsonify({'status': 'error', 'message': '采样分析器未运行'})
+        print(f"采样分析器已停止，共 {profiler.samples} 次采样")
+        # 折叠栈格式，可直接用于生成火焰图: flamegraph.pl profile.txt > profile.svg
+        return Response(collapsed, mimetype='text/plain')
+    
+    return jsonify({'status': 'error', 'message': '未知操作'})
+
 # WebSocket事件处理
 @socketio.on('connect', namespace='/music')
 def handle_connect():
@@ -289,7 +374,7 @@ def handle_connect():
     join_room('music_room')
     print(f"Web客户端连接: {client_id}")
     # 发送当前文件列表给新连接的客户端
-    emit('file_list_update', {'files': list(central_server.shared_files.keys())})
+    emit('file_list_update', {'files': central_server.registry.filenames()})
 
 @socketio.on('disconnect', namespace='/music')
 def handle_disconnect():
@@ -300,13 +385,23 @@ def handle_disconnect():
 
 @socketio.on('search', namespace='/music')
 def handle_search(data):
-    keyword = data.get('keyword', '').lower()
-    results = {}
-    for filename, peers in central_server.shared_files.items():
-        if keyword in filename.lower():
-            results[filename] = [central_server.peers[peer_id] for peer_id in peers]
+    keyword = data.get('keyword', '')
+    results = central_server.registry.search(keyword)
     emit('search_results', {'results': results})
 
+@socketio.on('search_batch', namespace='/music')
+def handle_search_batch(data):
+    if not isinstance(data, dict):
+        emit('search_batch_results', {'status': 'error', 'message': '请求必须是JSON对象'})
+        return
+    try:
+        results, sources = central_server.registry.search_batch(data.get('keywords', []),
+                                                                data.get('filenames', []))
+    except ValueError as e:
+        emit('search_batch_results', {'status': 'error', 'message': str(e)})
+        return
+    emit('search_batch_results', {'status': 'success', 'results': results, 'sources': sources})
+
 # 启动中心服务器和Web服务器
 def start_servers():
     # 确保必要的目录存在